@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+__author__ = "Jake Miller (@LaconicWolf)"
+__date__ = "20191019"
+__version__ = "0.01"
+__description__ = '''\
+A single entry point for the Android app testing scripts. Each subcommand's
+script is only imported when that subcommand is run, so startup only pays
+for the script being used.
+'''
+
+import sys
+
+if not sys.version.startswith('3'):
+    print('\n[-] This script will only work with Python3. Sorry!\n')
+    exit()
+
+import argparse
+import importlib
+
+
+# Maps a subcommand to the module that implements it and a short help string.
+# Each module exposes a cli(argv) function that parses its own arguments.
+SUBCOMMANDS = {
+    'repackage': ('repackage_apk_for_burp',
+                  'Repackage an APK to trust a user-installed CA cert.'),
+    'install-cert': ('install_burp_cert',
+                     'Install the Burp CA cert on a rooted pre-Nougat device.'),
+    'root-detect': ('check_for_root_detection',
+                    'Search decoded smali files for root detection strings.'),
+    'pinning': ('check_for_cert_pinning',
+                'Find network security config and code-level cert pinning.'),
+    'serve': ('apk_job_server',
+              'Run a local service that queues repackage and scan jobs.'),
+}
+
+
+def load_subcommand(name):
+    """Imports and returns the module implementing a subcommand."""
+    module_name = SUBCOMMANDS[name][0]
+    return importlib.import_module(module_name)
+
+
+def main(argv=None):
+    """Parses the subcommand and hands the remaining arguments to
+    the subcommand's cli() function.
+    """
+    parser = argparse.ArgumentParser(description=__description__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('subcommand',
+                        choices=SUBCOMMANDS,
+                        metavar='subcommand',
+                        help='One of: {}'.format(', '.join(
+                            '{} ({})'.format(name, info[1]) for name, info in SUBCOMMANDS.items())))
+    parser.add_argument('args',
+                        nargs=argparse.REMAINDER,
+                        help='Arguments for the subcommand. Use "<subcommand> -h" for details.')
+    parser.add_argument('-v', '--version',
+                        action='version',
+                        version='%(prog)s {}'.format(__version__))
+    args = parser.parse_args(argv)
+
+    module = load_subcommand(args.subcommand)
+    module.cli(args.args)
+
+
+if __name__ == '__main__':
+    main()
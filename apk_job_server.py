@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+__author__ = "Jake Miller (@LaconicWolf)"
+__date__ = "20191019"
+__version__ = "0.01"
+__description__ = '''\
+A long running service that repackages APKs and scans decoded APKs for root
+detection. Tool lookups, the signing keystore, the Burp CA cert and the
+search patterns are set up once, and jobs are submitted as JSON over local
+HTTP (or a Unix socket) and run by a fixed number of workers.
+
+Submit a job:   curl -d '{"type": "repackage", "apk": "/path/app.apk"}' http://127.0.0.1:8765/jobs
+                curl -d '{"type": "scan", "directory": "/path/app_out"}' http://127.0.0.1:8765/jobs
+Check a job:    curl http://127.0.0.1:8765/jobs/<id>
+Queue stats:    curl http://127.0.0.1:8765/stats
+'''
+
+import sys
+
+if not sys.version.startswith('3'):
+    print('\n[-] This script will only work with Python3. Sorry!\n')
+    exit()
+
+import os
+import json
+import time
+import uuid
+import shutil
+import argparse
+import threading
+import collections
+import socketserver
+from queue import Queue, Full
+
+import repackage_apk_for_burp as repackage
+import check_for_root_detection as root_detection
+
+
+JOB_TYPES = ('repackage', 'scan')
+
+# Number of recent latencies kept per job type for the stats endpoint.
+LATENCY_WINDOW = 1000
+
+jobs = collections.OrderedDict()
+jobs_lock = threading.Lock()
+cert_lock = threading.Lock()
+job_queue = None
+repackage_available = False
+running_jobs = 0
+job_counts = collections.Counter()
+latencies = {job_type: collections.deque(maxlen=LATENCY_WINDOW) for job_type in JOB_TYPES}
+
+
+def warm_up():
+    """Resolves the tools and generates the keystore once, so jobs
+    don't have to. Repackage jobs are refused if a tool is missing.
+    """
+    global repackage_available, keystore_present
+    print('[*] Checking for required tools...')
+    missing_tools = [tool for tool in ("apktool", "keytool", "jarsigner") if not repackage.check_for_tools(tool)]
+    for tool in missing_tools:
+        print("[-] {} could not be found in the current directory or in your PATH. Repackage jobs will be refused.".format(tool))
+    repackage_available = not missing_tools
+    if repackage_available and not keystore_present:
+        print("[*] Generating keystore...")
+        repackage.do_keytool(keystore_filename)
+        keystore_present = True
+
+
+def get_cert():
+    """Returns the path to the CA cert, downloading it from Burp the
+    first time it is needed.
+    """
+    global certname
+    with cert_lock:
+        if not certname:
+            if not repackage.check_for_burp(burp_host, burp_port):
+                raise RuntimeError("Burp not found on {}:{}".format(burp_host, burp_port))
+            print("[*] Downloading Burp cert from http://{}:{}".format(burp_host, burp_port))
+            certname = os.path.abspath(repackage.download_burp_cert(burp_host, burp_port))
+        return certname
+
+
+def submit_job(job_type, params):
+    """Validates and queues a job. Returns (job, error); job is
+    None if the job was refused.
+    """
+    if job_type == 'repackage':
+        apk = params.get('apk')
+        if not repackage_available:
+            return None, 'Repackaging is unavailable because a required tool is missing.'
+        if not isinstance(apk, str) or not apk.endswith('.apk') or not os.path.isfile(apk):
+            return None, 'Please specify the path to an existing .apk file as "apk".'
+    elif job_type == 'scan':
+        directory = params.get('directory')
+        # os.path.isdir() would treat an int as a file descriptor
+        if not isinstance(directory, str) or not directory or not os.path.isdir(directory):
+            return None, 'Please specify the path to a decoded APK directory as "directory".'
+    else:
+        return None, 'Unknown job type. Choose from: {}'.format(', '.join(JOB_TYPES))
+
+    job = {
+        'id': uuid.uuid4().hex,
+        'type': job_type,
+        'params': params,
+        'status': 'queued',
+        'submitted': time.time(),
+        'started': None,
+        'finished': None,
+        'result': None,
+        'error': None,
+    }
+    with jobs_lock:
+        try:
+            job_queue.put_nowait(job)
+        except Full:
+            return None, 'The job queue is full. Try again later.'
+        jobs[job['id']] = job
+        prune_jobs()
+    return job, None
+
+
+def prune_jobs():
+    """Forgets the oldest finished jobs once more than args.history
+    jobs are tracked. Must be called with jobs_lock held.
+    """
+    excess = len(jobs) - args.history
+    if excess <= 0:
+        return
+    for job_id in [job_id for job_id, job in jobs.items() if job['finished']][:excess]:
+        del jobs[job_id]
+
+
+def run_job(job):
+    """Runs a job and returns its result."""
+    if job['type'] == 'repackage':
+        # Each job decodes into its own directory, so jobs for the same
+        # APK can run at once and never see a previous job's files.
+        apk = job['params']['apk']
+        project_dir = os.path.join(args.output_dir, job['id'] + '_out')
+        timings = []
+        try:
+            new_apk = repackage.repackage_apk(apk, get_cert(), keystore_filename, timings, project_dir)
+            if not new_apk:
+                raise RuntimeError('Repackaging failed. See the server output for details.')
+            output_apk = os.path.join(args.output_dir, '{}_{}'.format(job['id'], os.path.basename(apk)))
+            shutil.move(new_apk, output_apk)
+        finally:
+            shutil.rmtree(project_dir, ignore_errors=True)
+        return {'apk': output_apk, 'stage_timings': timings}
+    else:
+        found, called = root_detection.main(job['params']['directory'], memory_budget_mb=args.scan_memory_budget)
+        return {
+            'findings': [{'file': f, 'method': m, 'string': s} for f, m, s in found],
+            'invocations': [{'method': m, 'file': f, 'caller': c} for m, f, c in called],
+        }
+
+
+def manage_job_queue():
+    """Takes jobs from the queue and runs them, recording the outcome."""
+    global running_jobs
+    while True:
+        job = job_queue.get()
+        with jobs_lock:
+            job['status'] = 'running'
+            job['started'] = time.time()
+            running_jobs += 1
+        try:
+            result, error = run_job(job), None
+        # The scripts exit() on some errors, so SystemExit is caught too
+        except (Exception, SystemExit) as e:
+            result, error = None, str(e) or e.__class__.__name__
+        with jobs_lock:
+            job['finished'] = time.time()
+            job['result'] = result
+            job['error'] = error
+            job['status'] = 'failed' if error else 'done'
+            running_jobs -= 1
+            job_counts[job['status']] += 1
+            latencies[job['type']].append(job['finished'] - job['submitted'])
+        job_queue.task_done()
+
+
+def summarize_latencies(values):
+    """Returns the count, mean, median, 95th percentile and maximum
+    of a list of latencies, in seconds.
+    """
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        'max': values[-1],
+    }
+
+
+def get_stats():
+    """Returns the queue depth, job counts and recent latencies."""
+    with jobs_lock:
+        return {
+            'queue_depth': job_queue.qsize(),
+            'max_queue': args.max_queue,
+            'workers': args.workers,
+            'running': running_jobs,
+            'done': job_counts['done'],
+            'failed': job_counts['failed'],
+            'repackage_available': repackage_available,
+            'latency_seconds': {job_type: summarize_latencies(list(latencies[job_type])) for job_type in JOB_TYPES},
+        }
+
+
+class JobRequestHandler():
+    """Handles job submission and status requests. Mixed into http.server's
+    BaseHTTPRequestHandler by create_server(), so http.server (and the
+    http.client and ssl modules it pulls in) is only imported when the
+    server starts rather than for "serve -h".
+    """
+
+    def send_json(self, status, data):
+        body = json.dumps(data, indent=2).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, get_stats())
+        elif self.path.startswith('/jobs/'):
+            with jobs_lock:
+                job = jobs.get(self.path[len('/jobs/'):])
+                job = dict(job) if job else None
+            if job:
+                self.send_json(200, job)
+            else:
+                self.send_json(404, {'error': 'Unknown job.'})
+        else:
+            self.send_json(404, {'error': 'Unknown path.'})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self.send_json(404, {'error': 'Unknown path.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(params, dict):
+                raise ValueError
+        except ValueError:
+            self.send_json(400, {'error': 'The request body must be a JSON object.'})
+            return
+        try:
+            job, error = submit_job(params.pop('type', None), params)
+        except Exception as e:
+            # Make sure the client gets a response rather than a closed connection
+            self.log_error('Error submitting job: %r', e)
+            self.send_json(500, {'error': 'Unable to submit the job: {}'.format(e)})
+            return
+        if job:
+            self.send_json(202, {'id': job['id'], 'status': job['status']})
+        else:
+            self.send_json(503 if 'full' in error else 400, {'error': error})
+
+    def address_string(self):
+        # Unix socket clients don't have a (host, port) address
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """An HTTP server listening on a Unix socket."""
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+def create_server():
+    """Returns an HTTP server listening on args.socket, or on
+    args.host and args.port.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class RequestHandler(JobRequestHandler, BaseHTTPRequestHandler):
+        pass
+
+    if args.socket:
+        return ThreadingUnixHTTPServer(args.socket, RequestHandler)
+    return ThreadingHTTPServer((args.host, args.port), RequestHandler)
+
+
+def main():
+    """Sets up the shared state, starts the workers and serves requests."""
+    global job_queue
+    warm_up()
+    job_queue = Queue(maxsize=args.max_queue)
+    for i in range(args.workers):
+        t = threading.Thread(target=manage_job_queue)
+        t.daemon = True
+        t.start()
+
+    server = create_server()
+    if args.socket:
+        print('[*] Listening on {} with {} workers'.format(args.socket, args.workers))
+    else:
+        print('[*] Listening on http://{}:{} with {} workers'.format(args.host, args.port, args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\n[*] Shutting down.')
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def cli(argv=None):
+    """Parses and validates command line arguments and runs main()."""
+    global args, keystore_present, keystore_filename, certname
+    global burp_host, burp_port
+    parser = argparse.ArgumentParser(description=__description__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Address to listen on (default 127.0.0.1).')
+    parser.add_argument('-p', '--port',
+                        type=int,
+                        default=8765,
+                        help='Port to listen on (default 8765).')
+    parser.add_argument('-s', '--socket',
+                        help='Listen on this Unix socket path instead of a TCP port.')
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=2,
+                        help='Number of jobs to run at once (default 2).')
+    parser.add_argument('-q', '--max_queue',
+                        type=int,
+                        default=100,
+                        help='Number of jobs that can wait in the queue before new jobs are refused (default 100).')
+    parser.add_argument('--history',
+                        type=int,
+                        default=1000,
+                        help='Number of jobs to remember for status requests (default 1000).')
+    parser.add_argument('-o', '--output_dir',
+                        default='repackaged',
+                        help='Directory for repackaged APKs, named <job id>_<apk name> (default ./repackaged).')
+    parser.add_argument('-m', '--scan_memory_budget',
+                        type=float,
+                        help='Read smali in chunks during scans and keep at most this many MB of file contents in memory at once per scan. Scans run concurrently (up to --workers), so the total can be --workers times this.')
+    parser.add_argument('-c', '--cert_path',
+                        help='Specify the path to either a PEM or DER formatted file.')
+    parser.add_argument('-k', '--keystore_path',
+                        help='Specify the path to an existing keystore.')
+    parser.add_argument("-pr", "--proxy",
+                        nargs='?',
+                        const="127.0.0.1:8080",
+                        default="127.0.0.1:8080",
+                        help="Specify the host and port where burp is listening (default 127.0.0.1:8080)")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1 or args.max_queue < 1:
+        print("[-] The number of workers and the queue size must be at least 1.")
+        exit()
+    args.output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    keystore_present = False
+    if args.keystore_path:
+        if not os.path.exists(args.keystore_path):
+            print("[-] The file, {}, cannot be found, or you do not have permission to open the file. Please check the file path and try again.".format(args.keystore_path))
+            exit()
+        keystore_filename = os.path.abspath(args.keystore_path)
+        keystore_present = True
+    else:
+        keystore_filename = os.path.abspath("my_keystore.keystore")
+        keystore_present = os.path.exists(keystore_filename)
+
+    if args.cert_path:
+        if not os.path.exists(args.cert_path):
+            print("[-] The file, {}, cannot be found, or you do not have permission to open the file. Please check the file path and try again.".format(args.cert_path))
+            exit()
+        certname = os.path.abspath(args.cert_path)
+    else:
+        certname = ''
+
+    if args.proxy.startswith('http'):
+        if '://' not in args.proxy:
+            print("[-] Unknown format for proxy. Please specify only a host and port (-pr 127.0.0.1:8080")
+            exit()
+        args.proxy = ''.join(args.proxy.split("//")[1:])
+
+    burp_host = args.proxy.split(":")[0]
+    burp_port = int(args.proxy.split(":")[1])
+    main()
+
+
+if __name__ == '__main__':
+    cli()
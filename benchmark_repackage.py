@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+__author__ = "Jake Miller (@LaconicWolf)"
+__date__ = "20191019"
+__version__ = "0.01"
+__description__ = '''\
+Benchmarks repackage_apk_for_burp.py without apktool or a JDK installed.
+Generates APKs of different sizes, puts stub apktool, keytool and jarsigner
+scripts (with configurable delays) on the PATH and runs the normal main()
+flow over them, then reports how long each stage took. The stub apktool
+really unzips and zips the APK, and the config, cert and manifest stages
+are the real code, so file I/O is measured too. Stubs are shell-style
+scripts, so this only works on Linux and macOS.
+
+Example: python3 benchmark_repackage.py -s 1 10 50 --build_delay 2 -o results.json
+'''
+
+import sys
+
+if not sys.version.startswith('3'):
+    print('\n[-] This script will only work with Python3. Sorry!\n')
+    exit()
+
+import os
+import io
+import json
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+import statistics
+import contextlib
+
+import repackage_apk_for_burp as repackage
+
+
+STUB_APKTOOL = '''\
+import os, sys, time, zipfile
+if sys.argv[1] == 'd':
+    time.sleep(float(os.environ.get('STUB_DECODE_DELAY', 0)))
+    apk, out_dir = sys.argv[2], sys.argv[4]
+    with zipfile.ZipFile(apk) as z:
+        z.extractall(out_dir)
+    os.makedirs(os.path.join(out_dir, 'res'), exist_ok=True)
+elif sys.argv[1] == 'b':
+    time.sleep(float(os.environ.get('STUB_BUILD_DELAY', 0)))
+    project_dir = sys.argv[2].rstrip(os.sep)
+    dist_dir = os.path.join(project_dir, 'dist')
+    os.makedirs(dist_dir, exist_ok=True)
+    name = os.path.basename(project_dir).replace('_out', '') + '.apk'
+    with zipfile.ZipFile(os.path.join(dist_dir, name), 'w', zipfile.ZIP_DEFLATED) as z:
+        for root, dirnames, filenames in os.walk(project_dir):
+            if root.startswith(dist_dir):
+                continue
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                z.write(path, os.path.relpath(path, project_dir))
+'''
+
+STUB_KEYTOOL = '''\
+import os, sys, time
+time.sleep(float(os.environ.get('STUB_KEYTOOL_DELAY', 0)))
+with open(sys.argv[sys.argv.index('-keystore') + 1], 'wb') as fh:
+    fh.write(os.urandom(2048))
+'''
+
+STUB_JARSIGNER = '''\
+import os, sys, time
+time.sleep(float(os.environ.get('STUB_JARSIGNER_DELAY', 0)))
+print('jar signed.')
+'''
+
+MANIFEST = '''\
+<?xml version="1.0" encoding="utf-8" standalone="no"?><manifest xmlns:android="http://schemas.android.com/apk/res/android" package="com.example.bench">
+    <application android:allowBackup="true" android:label="@string/app_name">
+    </application>
+</manifest>
+'''
+
+SMALI_METHOD = '''\
+.method public method{0}(Ljava/lang/String;)Ljava/lang/String;
+    .locals 2
+    const-string v0, "{1}"
+    invoke-virtual {{p1, v0}}, Ljava/lang/String;->concat(Ljava/lang/String;)Ljava/lang/String;
+    move-result-object v1
+    return-object v1
+.end method
+
+'''
+
+
+def write_stub_tools(stub_dir):
+    """Writes the stub apktool, keytool and jarsigner into stub_dir."""
+    for name, source in (('apktool', STUB_APKTOOL), ('keytool', STUB_KEYTOOL), ('jarsigner', STUB_JARSIGNER)):
+        path = os.path.join(stub_dir, name)
+        with open(path, 'w') as fh:
+            fh.write('#!{}\n'.format(sys.executable) + source)
+        os.chmod(path, 0o755)
+
+
+def generate_apk(path, size_mb, seed=0):
+    """Writes a zip that looks like an APK, with a manifest, resources and
+    roughly size_mb megabytes of (uncompressed) smali spread across classes.
+    """
+    rand = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    written = 0
+    class_number = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('AndroidManifest.xml', MANIFEST)
+        z.writestr('res/values/strings.xml',
+                   '<resources><string name="app_name">Bench</string></resources>\n')
+        while written < target:
+            body = io.StringIO()
+            body.write('.class public Lcom/example/bench/Class{0};\n.super Ljava/lang/Object;\n\n'.format(class_number))
+            for method_number in range(50):
+                body.write(SMALI_METHOD.format(method_number, '%032x' % rand.getrandbits(128)))
+            data = body.getvalue()
+            z.writestr('smali/com/example/bench/Class{}.smali'.format(class_number), data)
+            written += len(data)
+            class_number += 1
+
+
+def run_repackage(apk_paths, cert_path):
+    """Runs the repackager's normal command line flow over the APKs and
+    returns the recorded stage timings.
+    """
+    del repackage.stage_timings[:]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        repackage.cli(apk_paths + ['-c', cert_path])
+    return list(repackage.stage_timings)
+
+
+def summarize(timings):
+    """Groups stage timings by stage and returns the count, median, mean
+    and maximum for each, in seconds.
+    """
+    by_stage = {}
+    for timing in timings:
+        by_stage.setdefault(timing['stage'], []).append(timing['seconds'])
+    return {stage: {'count': len(values),
+                    'median': statistics.median(values),
+                    'mean': statistics.mean(values),
+                    'max': max(values)}
+            for stage, values in by_stage.items()}
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='repackage_bench_')
+    original_dir = os.getcwd()
+    results = {'settings': vars(args), 'sizes': {}}
+    try:
+        stub_dir = os.path.join(work_dir, 'stubs')
+        os.mkdir(stub_dir)
+        write_stub_tools(stub_dir)
+        os.environ['PATH'] = stub_dir + os.pathsep + os.environ.get('PATH', '')
+        os.environ['STUB_DECODE_DELAY'] = str(args.decode_delay)
+        os.environ['STUB_BUILD_DELAY'] = str(args.build_delay)
+        os.environ['STUB_KEYTOOL_DELAY'] = str(args.keytool_delay)
+        os.environ['STUB_JARSIGNER_DELAY'] = str(args.jarsigner_delay)
+
+        # The repackager writes its keystore and _out directories relative
+        # to the working directory, so keep everything in the temp dir.
+        os.chdir(work_dir)
+        cert_path = os.path.join(work_dir, 'cacert.der')
+        with open(cert_path, 'wb') as fh:
+            fh.write(b'\x30' + os.urandom(1023))
+
+        for size in args.sizes:
+            print('[*] Benchmarking {} MB APKs...'.format(size))
+            size_dir = os.path.join(work_dir, '{}mb'.format(size))
+            os.mkdir(size_dir)
+            apk_paths = []
+            for i in range(args.apks):
+                apk_path = os.path.join(size_dir, 'app{}.apk'.format(i))
+                generate_apk(apk_path, size, seed=i)
+                apk_paths.append(apk_path)
+
+            timings = []
+            for run in range(args.runs):
+                for apk_path in apk_paths:
+                    shutil.rmtree(apk_path.replace('.apk', '_out'), ignore_errors=True)
+                if os.path.exists('my_keystore.keystore'):
+                    os.remove('my_keystore.keystore')
+                timings.extend(run_repackage(apk_paths, cert_path))
+            summary = summarize(timings)
+            results['sizes'][str(size)] = {'stages': summary, 'timings': timings}
+
+            for stage, stats in sorted(summary.items(), key=lambda item: -item[1]['mean']):
+                print('    {:<28} median {:>8.3f}s  mean {:>8.3f}s  max {:>8.3f}s  (n={})'.format(
+                    stage, stats['median'], stats['mean'], stats['max'], stats['count']))
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+        print('[+] Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sizes',
+                        nargs='+',
+                        type=float,
+                        default=[1, 5, 25],
+                        help='Uncompressed smali size of the generated APKs in MB (default 1 5 25).')
+    parser.add_argument('-n', '--apks',
+                        type=int,
+                        default=2,
+                        help='Number of APKs of each size to repackage per run (default 2).')
+    parser.add_argument('-r', '--runs',
+                        type=int,
+                        default=3,
+                        help='Number of times to repackage each set of APKs (default 3).')
+    parser.add_argument('--decode_delay',
+                        type=float,
+                        default=0,
+                        help='Seconds the stub "apktool d" waits before decoding (default 0).')
+    parser.add_argument('--build_delay',
+                        type=float,
+                        default=0,
+                        help='Seconds the stub "apktool b" waits before building (default 0).')
+    parser.add_argument('--keytool_delay',
+                        type=float,
+                        default=0,
+                        help='Seconds the stub keytool waits (default 0).')
+    parser.add_argument('--jarsigner_delay',
+                        type=float,
+                        default=0,
+                        help='Seconds the stub jarsigner waits (default 0).')
+    parser.add_argument('-o', '--output',
+                        help='Write the settings, per-stage summary and raw timings as JSON to this file.')
+    args = parser.parse_args()
+    main()
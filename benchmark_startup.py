@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+__author__ = "Jake Miller (@LaconicWolf)"
+__date__ = "20191019"
+__version__ = "0.01"
+__description__ = '''\
+Measures the import time and cold start time of the scripts, and fails if
+a script gets slower than a limit or imports a heavy module at load time.
+Run from the repository directory: python3 benchmark_startup.py
+'''
+
+import sys
+
+if not sys.version.startswith('3'):
+    print('\n[-] This script will only work with Python3. Sorry!\n')
+    exit()
+
+import os
+import time
+import argparse
+import statistics
+import subprocess
+
+
+SCRIPTS = (
+    'android_app_testing',
+    'repackage_apk_for_burp',
+    'install_burp_cert',
+    'check_for_root_detection',
+    'check_for_cert_pinning',
+    'apk_job_server',
+)
+
+# Modules that are slow to import (or optional) and should only be
+# imported once they are actually needed.
+LAZY_MODULES = ('urllib.request', 'OpenSSL', 'http.client', 'ssl')
+
+
+def get_import_times(module_name):
+    """Imports a module in a fresh interpreter with -X importtime. Returns
+    the module's cumulative import time in microseconds, and the names of
+    every module imported along the way.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name],
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                            universal_newlines=True, cwd=repo_dir).stderr
+    cumulative = 0
+    imported = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = [field.strip() for field in line.split(':', 1)[1].split('|')]
+        if not fields[0].isdigit():
+            continue
+        name = fields[2]
+        imported.add(name)
+        if name == module_name:
+            cumulative = int(fields[1])
+    return cumulative, imported
+
+
+def time_cold_start(script, runs):
+    """Runs "script -h" in a fresh interpreter several times and returns the
+    median wall clock time in milliseconds.
+    """
+    script_path = os.path.join(repo_dir, script + '.py')
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script_path, '-h'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=repo_dir)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    failures = []
+    print('{:<28} {:>12} {:>14}'.format('script', 'import (ms)', 'cold -h (ms)'))
+    for script in SCRIPTS:
+        import_us, imported = get_import_times(script)
+        cold_ms = time_cold_start(script, args.runs)
+        print('{:<28} {:>12.1f} {:>14.1f}'.format(script, import_us / 1000, cold_ms))
+        if import_us / 1000 > args.max_import_ms:
+            failures.append('{} took {:.1f} ms to import (limit {} ms)'.format(
+                script, import_us / 1000, args.max_import_ms))
+        for module in LAZY_MODULES:
+            if module in imported:
+                failures.append('{} imports {} at load time'.format(script, module))
+    if failures:
+        for failure in failures:
+            print('[-] {}'.format(failure))
+        exit(1)
+    print('[+] All scripts are within the startup limits.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--runs',
+                        type=int,
+                        default=5,
+                        help='Number of cold starts to time for each script (default 5).')
+    parser.add_argument('-m', '--max_import_ms',
+                        type=float,
+                        default=60,
+                        help='Fail if a script takes longer than this to import (default 60).')
+    args = parser.parse_args()
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    main()
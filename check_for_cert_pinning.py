@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+__author__ = "Jake Miller (@LaconicWolf)"
+__date__ = "20191019"
+__version__ = "0.01"
+__description__ = '''\
+A script that looks for certificate pinning in a decoded APK. Reads the network
+security config(s) in res/xml for pin-sets, domain-configs and trust anchors,
+and searches smali files for pinning APIs such as OkHttp's CertificatePinner,
+custom TrustManagers and HostnameVerifiers, and hardcoded sha256/ pins.
+First, decode an APK with apktool "apktool d example.apk". Next, run this script
+from (or pass it) the newly created directory.
+'''
+
+import sys
+
+if not sys.version.startswith('3'):
+    print('\n[-] This script will only work with Python3. Sorry!\n')
+    exit()
+
+import os
+import re
+import argparse
+import threading
+from queue import Queue
+
+
+# Descriptions of pinning APIs and the smali that gives them away.
+# Config based pinning is handled by the network security config; these
+# are found in code and are not affected by it. Only calls that register
+# or check pins are matched: every app that bundles OkHttp references the
+# CertificatePinner class itself, whether or not it pins.
+PINNING_SIGNATURES = [
+    ('OkHttp CertificatePinner', r'L(?:okhttp3|com/squareup/okhttp)/CertificatePinner(?:\$Builder;->add|;->check)\('),
+    ('Custom X509TrustManager', r'^\.implements Ljavax/net/ssl/X509TrustManager;|^\.super Ljavax/net/ssl/X509ExtendedTrustManager;'),
+    ('Custom HostnameVerifier', r'^\.implements Ljavax/net/ssl/HostnameVerifier;'),
+    ('TrustKit', r'Lcom/datatheorem/android/trustkit/'),
+    ('Hardcoded certificate pin', r'"sha(?:1|256)/[A-Za-z0-9+/]{27,43}=*"'),
+]
+
+# Classes in these packages are the pinning libraries themselves (or TLS
+# providers) and use the APIs above whether or not the app pins.
+LIBRARY_PACKAGES = ('Lokhttp3/', 'Lcom/squareup/okhttp/', 'Lorg/conscrypt/', 'Lcom/android/org/conscrypt/',
+                    'Lcom/datatheorem/android/trustkit/')
+
+# A TrustManagerFactory initialised with a KeyStore loaded from the app's
+# resources trusts only the bundled certs. init() on its own is common
+# (init(null) is how OkHttp and Conscrypt get the system trust managers),
+# so this is only reported when all three calls are in the same method.
+BUNDLED_KEYSTORE_DESCRIPTION = 'TrustManagerFactory with a KeyStore loaded from a resource'
+BUNDLED_KEYSTORE_STEPS = {
+    'resource': re.compile(r'Landroid/content/res/Resources;->openRawResource\(|'
+                           r'Landroid/content/res/AssetManager;->open\(|'
+                           r'Ljava/lang/ClassLoader;->getResourceAsStream\('),
+    'load': re.compile(r'Ljava/security/KeyStore;->load\(Ljava/io/InputStream;'),
+    'init': re.compile(r'Ljavax/net/ssl/TrustManagerFactory;->init\(Ljava/security/KeyStore;\)V'),
+}
+
+# One regex for all signatures, with a named group per signature so a
+# match can be traced back to its description.
+PINNING_REGEX = re.compile('|'.join('(?P<sig{}>{})'.format(i, pattern)
+                                    for i, (name, pattern) in enumerate(PINNING_SIGNATURES)))
+MANIFEST_CONFIG_REGEX = re.compile(r'android:networkSecurityConfig="@xml/([^"]+)"')
+
+print_lock = threading.Lock()
+
+
+def find_smali_files(root_dir):
+    """Recursively looks for *.smali files and returns
+    a list containing the full file path.
+    """
+    smali_files = []
+    for root, dirnames, filenames in os.walk(root_dir):
+        for filename in filenames:
+            if filename.endswith('.smali'):
+                smali_files.append(os.path.join(root, filename))
+    return smali_files
+
+
+def search_smali_for_pinning(filename):
+    """Reads a smali file a line at a time and returns a list of
+    (filename, method, description, line) for each pinning API found.
+    Classes in LIBRARY_PACKAGES are skipped.
+    """
+    found = []
+    method_name = None
+    keystore_steps = {}
+    with open(filename, errors='replace') as fh:
+        for line in fh:
+            line = line.strip()
+            if line.startswith('.class'):
+                if line.split(' ')[-1].startswith(LIBRARY_PACKAGES):
+                    return []
+            elif line.startswith('.method'):
+                method_name = line.split(' ')[-1]
+                keystore_steps = {}
+            elif line.startswith('.end method'):
+                if len(keystore_steps) == len(BUNDLED_KEYSTORE_STEPS):
+                    found.append((filename, method_name, BUNDLED_KEYSTORE_DESCRIPTION, keystore_steps['init']))
+                method_name = None
+            for step, regex in BUNDLED_KEYSTORE_STEPS.items():
+                if regex.search(line):
+                    keystore_steps[step] = line
+            match = PINNING_REGEX.search(line)
+            if match:
+                description = PINNING_SIGNATURES[int(match.lastgroup[len('sig'):])][0]
+                found.append((filename, method_name, description, line))
+    return found
+
+
+def find_pinning_in_code(root_dir, threads=8):
+    """Searches every smali file under root_dir for pinning APIs using
+    a pool of threads. Returns a list of findings.
+    """
+    findings = []
+    file_queue = Queue()
+
+    def manage_file_queue():
+        while True:
+            filename = file_queue.get()
+            if filename is None:
+                break
+            try:
+                results = search_smali_for_pinning(filename)
+            except OSError as e:
+                with print_lock:
+                    print('[-] Unable to read {}: {}'.format(filename, e))
+                results = []
+            findings.extend(results)
+
+    workers = [threading.Thread(target=manage_file_queue) for i in range(threads)]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    for filename in find_smali_files(root_dir):
+        file_queue.put(filename)
+    for t in workers:
+        file_queue.put(None)
+    for t in workers:
+        t.join()
+    return findings
+
+
+def get_network_security_config_name(project_dir):
+    """Returns the name of the network security config referenced by
+    the manifest (without .xml), or None if there isn't one.
+    """
+    try:
+        with open(os.path.join(project_dir, 'AndroidManifest.xml'), errors='replace') as fh:
+            match = MANIFEST_CONFIG_REGEX.search(fh.read())
+    except FileNotFoundError:
+        return None
+    return match.group(1) if match else None
+
+
+def find_network_security_configs(project_dir):
+    """Returns the paths of every res/xml*/ file that is a network
+    security config.
+    """
+    res_dir = os.path.join(project_dir, 'res')
+    configs = []
+    if not os.path.isdir(res_dir):
+        return configs
+    for dirname in sorted(os.listdir(res_dir)):
+        if not dirname.startswith('xml'):
+            continue
+        for filename in sorted(os.listdir(os.path.join(res_dir, dirname))):
+            filepath = os.path.join(res_dir, dirname, filename)
+            with open(filepath, 'rb') as fh:
+                if b'<network-security-config' in fh.read():
+                    configs.append(filepath)
+    return configs
+
+
+def analyze_network_security_config(filepath):
+    """Parses a network security config and returns a dict describing
+    its pin-sets, domain-configs and whether user certs are trusted.
+    """
+    import xml.etree.ElementTree as ET
+    root = ET.parse(filepath).getroot()
+    base_config = root.find('base-config')
+    base_sources = []
+    if base_config is not None:
+        base_sources = [c.get('src') for c in base_config.iter('certificates')]
+    pin_sets = []
+    for domain_config in root.iter('domain-config'):
+        pin_set = domain_config.find('pin-set')
+        if pin_set is not None:
+            pin_sets.append({
+                'domains': [d.text.strip() for d in domain_config.findall('domain') if d.text],
+                'pins': len(pin_set.findall('pin')),
+                'expiration': pin_set.get('expiration'),
+            })
+    return {
+        'file': filepath,
+        'domain_configs': len(list(root.iter('domain-config'))),
+        'pin_sets': pin_sets,
+        'trusts_user_certs': 'user' in base_sources,
+        'trust_anchors': base_sources,
+    }
+
+
+def main(root_dir='.'):
+    """Prints and returns the config and code pinning found under root_dir."""
+    config_name = get_network_security_config_name(root_dir)
+    if config_name:
+        print('[*] The manifest uses @xml/{} as its network security config.'.format(config_name))
+    else:
+        print('[*] The manifest does not reference a network security config.')
+
+    configs = [analyze_network_security_config(path) for path in find_network_security_configs(root_dir)]
+    for config in configs:
+        print('[*] {}: {} domain-config(s), base trust anchors: {}'.format(
+            config['file'], config['domain_configs'], ', '.join(filter(None, config['trust_anchors'])) or 'default'))
+        for pin_set in config['pin_sets']:
+            print('[+] Pin-set with {} pin(s) for {} (expires {})'.format(
+                pin_set['pins'], ', '.join(pin_set['domains']), pin_set['expiration'] or 'never'))
+
+    print('[*] Searching .smali files for certificate pinning APIs...')
+    code_findings = find_pinning_in_code(root_dir)
+    # Class-level findings (.implements/.super) have no method
+    for filename, method_name, description, line in sorted(code_findings, key=lambda f: (f[0], f[1] or '', f[2], f[3])):
+        print('{}, {}, {}, {}'.format(filename, method_name or '<class>', description, line))
+    if not code_findings:
+        print('[-] No pinning APIs found in the smali files.')
+    return configs, code_findings
+
+
+def cli(argv=None):
+    """Parses command line arguments and runs main()."""
+    parser = argparse.ArgumentParser(description=__description__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory',
+                        nargs='?',
+                        default='.',
+                        help='The directory of the decoded APK (default is the current directory).')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        print('[-] {} is not a directory.'.format(args.directory))
+        exit()
+    main(args.directory)
+
+
+if __name__ == '__main__':
+    cli()
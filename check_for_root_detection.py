@@ -17,9 +17,185 @@ if not sys.version.startswith('3'):
 
 import os
 import re
+import bisect
+import argparse
 import threading
 from queue import Queue
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, so peak RSS isn't reported there
+    resource = None
+
+
+ROOT_DETECTION_STRINGS = [
+    "/system/app/Superuser.apk", "/sbin/su",
+    "/system/bin/su", "/system/xbin/su", "/data/local/xbin/su",
+    "/data/local/bin/su", "/system/sd/xbin/su",
+    "/system/bin/failsafe/su", "/data/local/su", "/su/bin/su",
+    "test-keys", '"/system/xbin/which", "su"', "'/system/xbin/which', 'su'",
+]
+
+# Compiled once at import rather than for every file searched.
+ROOT_DETECTION_REGEX = re.compile('|'.join(re.escape(x) for x in ROOT_DETECTION_STRINGS))
+METHOD_START_REGEX = re.compile(r'\.method')
+METHOD_END_REGEX = re.compile(r'\.end method')
+
+# How many chunk_size pieces of text a worker can hold at once, as a
+# multiple of chunk_size. iter_method_chunks never buffers more than
+# chunk_size characters and yields at most a .method line plus chunk_size
+# (2x). While building the next chunk, the previous one (2x) is still held
+# by the caller, along with the buffer (1x), the piece cut from it (1x) and
+# the new chunk (2x). Smali is almost all ASCII, so a character is a byte.
+CHUNK_COPIES = 6
+
+method_names = []
+#method_call_tree = {}
+
+print_lock = threading.Lock()
+# Items are (function, filename, scan), shared by every scan
+file_queue = Queue()
+workers_lock = threading.Lock()
+workers_started = False
+
+
+class RootDetectionScan():
+    """The settings and results of one call to main(). Each scan has its
+    own, so a long running process can run several scans at once on the
+    shared worker threads. With a memory budget, files are read in chunks
+    of chunk_size characters instead of all at once.
+    """
+
+    def __init__(self, root_dir='.', memory_budget=None, chunk_size=None):
+        self.root_dir = root_dir
+        self.memory_budget = memory_budget
+        self.chunk_size = chunk_size
+        self.findings = []
+        self.invocations = []
+        self.method_paths = set()
+        self.method_regex = None
+        self.pending = 0
+        self.condition = threading.Condition()
+
+    def search_files(self, function, filenames):
+        """Queues function(filename, scan) for each file and waits until
+        they have all been searched.
+        """
+        with self.condition:
+            self.pending += len(filenames)
+        for filename in filenames:
+            file_queue.put((function, filename, self))
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+
+    def file_done(self):
+        with self.condition:
+            self.pending -= 1
+            if not self.pending:
+                self.condition.notify_all()
+
+
+class MemoryBudget():
+    """Limits how many bytes of file contents the worker threads hold at
+    once. Threads block in acquire() until enough of the budget is free.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        """Reserves size bytes (at most the whole budget) and returns
+        the amount reserved, which must be passed to release().
+        """
+        size = min(size, self.limit)
+        with self.condition:
+            while self.in_use + size > self.limit:
+                self.condition.wait()
+            self.in_use += size
+            self.peak = max(self.peak, self.in_use)
+        return size
+
+    def release(self, size):
+        with self.condition:
+            self.in_use -= size
+            self.condition.notify_all()
+
+
+def iter_method_chunks(fh, size, overlap):
+    """Reads an open smali file size characters at a time and yields
+    chunks that end just after an ".end method" line, so each method
+    is searched whole. A method too big for one chunk is split on a line
+    break, and the following chunks start with the method's ".method"
+    line so matches in them are still attributed to it. A line too big
+    for one chunk is split with overlap characters repeated in the next
+    chunk, so a match across the split is still found.
+
+    Yields (chunk, searched) pairs, where searched is the number of
+    characters at the start of the chunk that were already in the previous
+    chunk. Matches that end within them have already been found.
+    """
+    buffer = ''
+    header = ''
+    # Characters at the start of buffer repeated from the previous chunk
+    carried = 0
+    overlap = min(overlap, size // 2)
+    while True:
+        # Only read enough to fill the buffer to size, so a partial line
+        # left over from the last chunk doesn't make the next one bigger.
+        data = fh.read(size - len(buffer))
+        if not data:
+            if buffer:
+                yield header + buffer, len(header) + carried
+            return
+        buffer += data
+        end = buffer.rfind('.end method')
+        if end != -1:
+            end = buffer.find('\n', end)
+            end = len(buffer) if end == -1 else end + 1
+            yield header + buffer[:end], len(header) + carried
+            buffer = buffer[end:]
+            header = ''
+            carried = 0
+        elif len(buffer) >= size:
+            cut = buffer.rfind('\n') + 1
+            searched = len(header) + carried
+            if cut > 0:
+                piece, buffer = buffer[:cut], buffer[cut:]
+                carried = 0
+            else:
+                piece, buffer = buffer, buffer[-overlap:]
+                carried = len(buffer)
+            yield header + piece, searched
+            start = piece.rfind('.method')
+            if start != -1:
+                header = piece[start:piece.find('\n', start) + 1]
+
+
+def iter_file_contents(filename, patterns, scan):
+    """Yields the contents of a file to search for patterns, with the number
+    of leading characters that were already searched. Without a memory
+    budget this is the whole file. With one, the file is read in
+    method-aligned chunks (see iter_method_chunks), and the thread waits
+    until its share of the scan's budget is free before reading.
+    """
+    if scan.memory_budget is None:
+        with open(filename) as fh:
+            yield fh.read(), 0
+        return
+    reserved = scan.memory_budget.acquire(min(os.path.getsize(filename), scan.chunk_size) * CHUNK_COPIES)
+    try:
+        with open(filename) as fh:
+            overlap = max(len(x) for x in patterns) - 1
+            for chunk, searched in iter_method_chunks(fh, scan.chunk_size, overlap):
+                yield chunk, searched
+    finally:
+        scan.memory_budget.release(reserved)
+
 
 def find_smali_files(root_dir):
     """Recursively looks for *.smali files and returns
@@ -33,7 +209,7 @@ def find_smali_files(root_dir):
     return smali_files
 
 
-def search_text_for_root_detection_strings(textfile):
+def search_text_for_root_detection_strings(textfile, scan):
     """Reads and searches a specified textfile for presence 
     of root detection strings. Returns the name
     of the text file and matches if a match is found. Based on:
@@ -41,126 +217,189 @@ def search_text_for_root_detection_strings(textfile):
     and:
     https://stackoverflow.com/questions/12286928/fastest-way-in-python-to-search-for-multiple-items-in-a-body-of-text
     """
-    root_detection_strings = [
-                "/system/app/Superuser.apk", "/sbin/su",
-                "/system/bin/su", "/system/xbin/su", "/data/local/xbin/su",
-                "/data/local/bin/su", "/system/sd/xbin/su", 
-                "/system/bin/failsafe/su", "/data/local/su", "/su/bin/su",
-                "test-keys", '"/system/xbin/which", "su"', "'/system/xbin/which', 'su'",
-            ]
-    with open(textfile) as fh:
-        contents = fh.read()
-    regex = re.compile('|'.join(re.escape(x) for x in root_detection_strings))
-    found = regex.findall(contents)
-    if found:
-        for item in found:
-            method_name, matched_string = find_parent_method(contents, item)
+    for contents, searched in iter_file_contents(textfile, ROOT_DETECTION_STRINGS, scan):
+        methods = find_methods(contents)
+        for m in ROOT_DETECTION_REGEX.finditer(contents):
+            if m.end() <= searched:
+                continue
+            method_name = find_parent_method(contents, m.start(), methods)
+            if not method_name:
+                continue
+            matched_string = m.group()
             with print_lock:
                 print("{}, {}, {}".format(textfile, method_name, matched_string))
-            method_paths.append(make_method_path(textfile, method_name))
+                scan.findings.append((textfile, method_name, matched_string))
+                scan.method_paths.add(make_method_path(textfile, method_name, scan.root_dir))
+
 
+def find_methods(file_contents):
+    """Returns lists of the start and end offsets of the methods in
+    file_contents, for find_parent_method.
+    """
+    start_method_indices = [c.start() for c in METHOD_START_REGEX.finditer(file_contents)]
+    end_method_indices = [c.start() for c in METHOD_END_REGEX.finditer(file_contents)]
+    # A chunk can end partway through its last method
+    end_method_indices += [len(file_contents)] * (len(start_method_indices) - len(end_method_indices))
+    return start_method_indices, end_method_indices
 
-def find_parent_method(file_contents, string):
-    """Return the name of a method where a string is found."""
-    start_method_indices = [c.start() for c in re.finditer('\.method', file_contents)]
-    end_method_indices = [c.start() for c in re.finditer('\.end method', file_contents)]
-    for index in zip(start_method_indices, end_method_indices):
-        method = file_contents[index[0]:index[1]]
-        if string in method:
-            method_name = method.split('\n')[0]
-            return method_name, string
+
+def find_parent_method(file_contents, index, methods):
+    """Return the name of the method containing the match at index, or
+    None if it is outside of a method. methods comes from find_methods().
+    """
+    start_method_indices, end_method_indices = methods
+    i = bisect.bisect_right(start_method_indices, index) - 1
+    if i < 0 or index >= end_method_indices[i]:
+        return None
+    start, end = start_method_indices[i], end_method_indices[i]
+    line_end = file_contents.find('\n', start, end)
+    return file_contents[start:end if line_end == -1 else line_end]
 
 
-def find_method_invocation(filename, methods=None):
-    """Reads a file to check if a method is called.
+def find_method_invocation(filename, scan, methods=None):
+    """Reads a file to check if a method is called. Defaults to the
+    methods the scan found root detection strings in.
     """
-    methods = methods if methods else method_paths
-    with open(filename) as fh:
-        contents = fh.read()
-    regex = re.compile('|'.join(re.escape(x) for x in methods))
-    found = regex.findall(contents)
-    if found:
-        for item in found:
-            method_name, matched_string = find_parent_method(contents, item)
+    if methods:
+        regex = re.compile('|'.join(re.escape(x) for x in methods))
+    else:
+        methods, regex = scan.method_paths, scan.method_regex
+    for contents, searched in iter_file_contents(filename, methods, scan):
+        method_offsets = find_methods(contents)
+        for m in regex.finditer(contents):
+            if m.end() <= searched:
+                continue
+            method_name = find_parent_method(contents, m.start(), method_offsets)
+            if not method_name:
+                continue
+            item = m.group()
             with print_lock:
                 print(("[+] The method {},\n"
                       #"    contained the string {},\n"
                       "    was called in the file {},\n"
                       "    from the method {}").format(item, filename, method_name.split(' ')[-1]))
+                scan.invocations.append((item, filename, method_name.split(' ')[-1]))
 
 
-def make_method_path(file_path, method):
+def make_method_path(file_path, method, root_dir='.'):
     """Transforms/combines a file path and method name to easier 
     search for its invocation.
     """
+    file_path = os.path.relpath(file_path, root_dir)
     if os.sep == '\\':
         file_path = file_path.replace('\\', '/')
-    if file_path.startswith('./smali/'):
-        file_path = file_path.replace('./smali/', '')
+    # Drop the smali/ (or smali_classes2/, etc.) directory
+    if file_path.startswith('smali'):
+        file_path = file_path.split('/', 1)[-1]
     if file_path.endswith('.smali'):
-        file_path = file_path.replace('.smali', '')
+        file_path = file_path[:-len('.smali')]
     method = method.split(' ')[-1]
     return file_path + ';->' + method
 
 
-def manage_root_detect_queue():
-    """Manages the smali file queue and calls the 
-    search_text_for_root_detection_strings function.
+def manage_file_queue():
+    """Manages the smali file queue. Each item is a function, the
+    file to call it with and the scan the file belongs to.
     """
     while True:
-        current_filename = file_queue.get()
-        search_text_for_root_detection_strings(current_filename)
-        file_queue.task_done()
+        function, current_filename, scan = file_queue.get()
+        try:
+            function(current_filename, scan)
+        except Exception as e:
+            with print_lock:
+                print('[-] Error searching {}: {}'.format(current_filename, e))
+        finally:
+            scan.file_done()
+            file_queue.task_done()
 
 
-def manage_method_invoke_queue():
-    """Manages the smali file queue and calls the 
-    search_text_for_root_detection_strings function.
+def start_workers(count=20):
+    """Starts the threads that work the file queue. The threads are
+    only started once, and are shared by every scan.
     """
-    while True:
-        current_filename = file_queue.get()
-        find_method_invocation(current_filename)
-        file_queue.task_done()
+    global workers_started
+    with workers_lock:
+        if workers_started:
+            return
+        for i in range(count):
+            t = threading.Thread(target=manage_file_queue)
+            t.daemon = True
+            t.start()
+        workers_started = True
+
+
+def get_peak_rss_mb():
+    """Returns the peak resident memory of this process over its whole
+    lifetime in MB, or None if it can't be determined.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
 
+def main(root_dir='.', memory_budget_mb=None, chunk_kb=256):
+    """Searches the smali files under root_dir for root detection strings,
+    then for calls to the methods containing them. Returns the findings
+    and invocations as lists of tuples. If memory_budget_mb is given, files
+    are read in chunks of up to chunk_kb KB, and the worker threads together
+    hold no more than memory_budget_mb MB of this scan's file contents at
+    once. The results (findings, invocations, method_paths and the regex
+    built from them) are not counted against the budget. Each call has its
+    own state, so main() can be called from several threads at once.
+    """
+    scan = RootDetectionScan(root_dir)
+    if memory_budget_mb:
+        scan.memory_budget = MemoryBudget(int(memory_budget_mb * 1024 * 1024))
+        # Make sure at least one chunk fits in the budget
+        scan.chunk_size = max(1024, min(int(chunk_kb * 1024), scan.memory_budget.limit // CHUNK_COPIES))
 
-def main():
-    root_dir = '.'
     print('[*] Checking for .smali files...')
     smali_file_list = find_smali_files(root_dir)
     if smali_file_list:
         print('[+] Found {} .smali files.'.format(len(smali_file_list)))
     else:
-        print('[-] No .smali files found while searching recursively from {}.'.format(os.getcwd()))
+        print('[-] No .smali files found while searching recursively from {}.'.format(os.path.abspath(root_dir)))
         exit()
     print('[*] Searching files for strings that are commonly used for root detection...')
 
-    for i in range(20):
-        t = threading.Thread(target=manage_root_detect_queue)
-        t.daemon = True
-        t.start()
+    start_workers()
+    scan.search_files(search_text_for_root_detection_strings, smali_file_list)
 
-    for current_file in smali_file_list:
-        file_queue.put(current_file)
-    file_queue.join()
+    if scan.method_paths:
+        print("[*] Searching .smali files for the method invocations...")
+        scan.method_regex = re.compile('|'.join(re.escape(x) for x in scan.method_paths))
+        scan.search_files(find_method_invocation, smali_file_list)
 
-    print("[*] Searching .smali files for the method invocations...")
+    if scan.memory_budget:
+        print('[*] Peak file contents held: {:.1f} MB of the {:.1f} MB budget ({} KB chunks).'.format(
+            scan.memory_budget.peak / (1024 * 1024), scan.memory_budget.limit / (1024 * 1024), scan.chunk_size // 1024))
 
-    for i in range(20):
-        t = threading.Thread(target=manage_method_invoke_queue)
-        t.daemon = True
-        t.start()
+    return scan.findings, scan.invocations
 
-    for current_file in smali_file_list:
-        file_queue.put(current_file)
-    file_queue.join()
 
-if __name__ == '__main__':
+def cli(argv=None):
+    """Parses command line arguments and runs main()."""
+    parser = argparse.ArgumentParser(description=__description__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-m', '--memory_budget',
+                        type=float,
+                        help='Read files in chunks and keep at most this many MB of file contents in memory at once.')
+    parser.add_argument('--chunk_size',
+                        type=float,
+                        default=256,
+                        help='Chunk size in KB when a memory budget is set (default 256).')
+    args = parser.parse_args(argv)
+    main(memory_budget_mb=args.memory_budget, chunk_kb=args.chunk_size)
 
-    method_names = []
-    method_paths = []
-    #method_call_tree = {}
+    # ru_maxrss covers the whole life of the process, so it's only
+    # meaningful here, where the process ran a single scan.
+    if args.memory_budget:
+        peak_rss = get_peak_rss_mb()
+        if peak_rss:
+            print('[*] Peak RSS of this process: {:.1f} MB.'.format(peak_rss))
 
-    print_lock = threading.Lock()
-    file_queue = Queue()
 
-    main()
+if __name__ == '__main__':
+    cli()
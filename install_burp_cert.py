@@ -6,17 +6,12 @@ if not sys.version.startswith('3'):
     print('\n[-] This script will only work with Python3. Sorry!\n')
     exit()
 
-import urllib.request
 import subprocess
 import os
 import shutil
 import argparse
-
-try:
-    import OpenSSL
-except ImportError:
-    print("[-] This script requires pyOpenSSL. Try 'python3 -m pip install pyopenssl' or consult the Internet for installation instructions.")
-    exit()
+import binascii
+import functools
 
 __author__ = "Jake Miller (@LaconicWolf)"
 __date__ = "20190705"
@@ -25,8 +20,11 @@ __description__ = '''A script to help install a Burp proxy certificate on Androi
 Largely based on https://blog.ropnop.com/configuring-burp-suite-with-android-nougat/'''
 
 
+@functools.lru_cache(maxsize=None)
 def check_for_tools(name):
-    """Checks to see whether the tool name is in current directory or in the PATH"""
+    """Checks to see whether the tool name is in current directory or in the PATH.
+    Results are cached, so each tool is only resolved once per process.
+    """
     if is_in_dir(name) or is_in_path(name):
         return True
     else:
@@ -35,6 +33,8 @@ def check_for_tools(name):
 
 def check_for_burp(host, port):
     """Checks to see if Burp is running."""
+    # urllib.request is slow to import, so only pay for it when Burp is needed.
+    import urllib.request
     url = ("http://{}:{}/".format(host, port))
     try:
         resp = urllib.request.urlopen(url)
@@ -48,6 +48,7 @@ def check_for_burp(host, port):
 
 def download_burp_cert(host, port):
     """Downloads the Burp Suite certificate."""
+    import urllib.request
     url = ("http://{}:{}/cert".format(host, port))
     file_name = 'cacert.cer'
     # Download the file from url and save it locally under file_name:
@@ -70,11 +71,16 @@ def is_in_path(name):
 
 def is_in_dir(name, directory='.'):
     """Checks whether a file exists in a specified directory."""
-    files = (os.listdir(directory))
-    for file in files:
-        if file.lower() == name.lower():
-            if os.path.isfile(file):
-                return True
+    return name.lower() in list_dir_files(os.path.abspath(directory))
+
+
+@functools.lru_cache(maxsize=None)
+def list_dir_files(directory):
+    """Returns the lowercased names of the files in a directory. Cached
+    so that checking several tools only lists the directory once.
+    """
+    return frozenset(file.lower() for file in os.listdir(directory)
+                     if os.path.isfile(os.path.join(directory, file)))
 
 
 def get_devices():
@@ -123,15 +129,30 @@ def get_root(device_id):
     output = subprocess.getoutput("adb -s {} root".format(device_id))
 
 
+def der_to_pem(der):
+    """Returns the PEM encoding of a DER certificate. PEM is just the
+    base64 of the DER wrapped at 64 characters between the BEGIN/END lines,
+    so this doesn't need pyOpenSSL.
+    """
+    if not der.startswith(b'\x30'):
+        raise ValueError('Data does not look like a DER encoded certificate')
+    b64 = binascii.b2a_base64(der, newline=False)
+    lines = [b64[i:i + 64] for i in range(0, len(b64), 64)]
+    return b'-----BEGIN CERTIFICATE-----\n' + b'\n'.join(lines) + b'\n-----END CERTIFICATE-----\n'
+
+
 def convert_der_to_pem(filename):
     """Converts a der to a pem and writes to the filesystem."""
     with open(filename, 'rb') as fh:
         der = fh.read()
-    cert = OpenSSL.crypto.load_certificate(type=OpenSSL.crypto.FILETYPE_ASN1, buffer=der)
-    
+
     # OpenSSL and pyOpenSSL coming up with different hashes. Hardcoding it for now.
-    pem_hash = '9a5ba575' # str(cert.subject_name_hash())
-    pem_bytes = OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert)
+    pem_hash = '9a5ba575'
+    try:
+        pem_bytes = der_to_pem(der)
+    except ValueError as e:
+        print('[-] Unable to convert {} to PEM: {}'.format(filename, e))
+        exit()
     pem_filename = pem_hash + ".0"
     with open(pem_filename, 'wb') as fh:
         fh.write(pem_bytes)
@@ -177,19 +198,15 @@ def main():
     and attempts to convert and install the Burp cert on a specific device.
     """
 
-    # Check for adb and burp. May check for openssl in the future...
+    # Check for adb. Burp is checked right before the cert is needed,
+    # so runs that fail on the device checks don't wait on it.
     required_tools = ("adb",)
     missing_tools = []
     for tool in required_tools:
         if not check_for_tools(tool):
             missing_tools.append(tool)
-    burp = check_for_burp(burp_host, burp_port)
-
-    if not burp or missing_tools:
-        if not burp:
-            print('[-] Unable to connect to Burp at {}:{}. Please ensure the Burp web UI is running and available.'.format(burp_host, burp_port))
-        for tool in missing_tools:
-            print("[-] {} could not be found in the current directory or in your PATH. Please ensure either of these conditions are met.".format(tool))
+    for tool in missing_tools:
+        print("[-] {} could not be found in the current directory or in your PATH. Please ensure either of these conditions are met.".format(tool))
 
     # Check for connected devices
     print('[*] Checking for connected devices')
@@ -232,6 +249,9 @@ def main():
 
     # Attempt to download and convert the cert from der to pem
     print("[*] Attempting to add the Burp CA cert to the device")
+    if not check_for_burp(burp_host, burp_port):
+        print('[-] Unable to connect to Burp at {}:{}. Please ensure the Burp web UI is running and available.'.format(burp_host, burp_port))
+        exit()
     print("[*] Downloading cert from http://{}:{}".format(burp_host, burp_port))
     certname = download_burp_cert(burp_host, burp_port)
     print("[*] Converting Burp Cert to pem")
@@ -257,20 +277,26 @@ def main():
     reboot_device(device)
 
 
-if __name__ == '__main__':
+def cli(argv=None):
+    """Parses command line arguments and runs main()."""
+    global burp_host, burp_port
     parser = argparse.ArgumentParser()
     parser.add_argument("-pr", "--proxy",
                         nargs='?',
                         const="127.0.0.1:8080",
                         default="127.0.0.1:8080",
                         help="Specify a proxy to use (default 127.0.0.1:8080)")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.proxy.startswith('http'):
         if '://' not in args.proxy:
             print("[-] Unknown format for proxy. Please specify only a host and port (-pr 127.0.0.1:8080")
             exit()
         args.proxy = ''.join(args.proxy.split("//")[1:])
-    burp_host = args.proxy.split(":")[0] 
+    burp_host = args.proxy.split(":")[0]
     burp_port = int(args.proxy.split(":")[1])
-    main()
\ No newline at end of file
+    main()
+
+
+if __name__ == '__main__':
+    cli()
@@ -10,7 +10,10 @@ import subprocess
 import os
 import shutil
 import argparse
-import urllib.request
+import functools
+import contextlib
+import threading
+import time
 
 
 __author__ = "Jake Miller (@LaconicWolf)"
@@ -19,8 +22,16 @@ __version__ = "0.01"
 __description__ = '''A script to repackage an APK file to allow a user-installed SSL certificate.'''
 
 
+# Time taken by each repackaging stage, as dicts with the apk, stage and
+# seconds. Written out as JSON with -t/--timings.
+stage_timings = []
+
+
+@functools.lru_cache(maxsize=None)
 def check_for_tools(name):
-    """Checks to see whether the tool name is in current directory or in the PATH"""
+    """Checks to see whether the tool name is in current directory or in the PATH.
+    Results are cached, so each tool is only resolved once per process.
+    """
     if is_in_dir(name) or is_in_path(name):
         return True
     else:
@@ -36,21 +47,37 @@ def is_in_path(name):
 
 def is_in_dir(name, directory='.'):
     """Checks whether a file exists in a specified directory."""
-    files = (os.listdir(directory))
-    for file in files:
-        if file.lower() == name.lower():
-            if os.path.isfile(file):
-                return True
+    return name.lower() in list_dir_files(os.path.abspath(directory))
 
 
-def apktool_decompile(filename):
-    """Uses APKTool to decompile an APK"""
-    output = subprocess.getoutput("apktool d {} -o {}".format(filename, filename.replace('.apk', '_out')))
+@functools.lru_cache(maxsize=None)
+def list_dir_files(directory):
+    """Returns the lowercased names of the files in a directory. Cached
+    so that checking several tools only lists the directory once.
+    """
+    return frozenset(file.lower() for file in os.listdir(directory)
+                     if os.path.isfile(os.path.join(directory, file)))
+
+
+def apktool_decompile(filename, project_dir=None):
+    """Uses APKTool to decompile an APK. If project_dir is given, decodes
+    into it (overwriting anything there), otherwise into <name>_out.
+    """
+    if project_dir:
+        command = ['apktool', 'd', filename, '-o', project_dir, '-f']
+    else:
+        project_dir = filename.replace('.apk', '_out')
+        command = ['apktool', 'd', filename, '-o', project_dir]
+    # Argument lists rather than a shell string, so paths with spaces or
+    # shell metacharacters (the job server takes them from requests) are
+    # passed through as they are.
+    output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True).stdout
     if 'Exception in' in output:
         print('[-] An error occurred when decompiling the APK.')
         print(output)
         try:
-            os.rmdir(filename.replace('.apk', '_out'))
+            os.rmdir(project_dir)
         except:
             pass
         return False
@@ -60,7 +87,8 @@ def apktool_decompile(filename):
 
 def apktool_build(filepath):
     """Uses APKTool to create a new APK"""
-    output = subprocess.getoutput("apktool b {}".format(filepath))
+    output = subprocess.run(['apktool', 'b', filepath], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True).stdout
     try:
         os.listdir(filepath + os.sep + 'dist')
     except FileNotFoundError:
@@ -93,14 +121,19 @@ def do_keytool(keystore_name):
 
 
 def do_jarsigner(filepath, keystore):
-    """Uses APKTool to create a new APK"""
-    output = subprocess.getoutput("jarsigner -verbose -keystore {} -storepass password -keypass password {} android".format(keystore, filepath))
+    """Uses jarsigner to sign an APK. Returns True if it was signed."""
+    output = subprocess.run(['jarsigner', '-verbose', '-keystore', keystore, '-storepass', 'password',
+                             '-keypass', 'password', filepath, 'android'],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True).stdout
     if 'jar signed.' not in output:
         print("[-] An error occurred during jarsigner: \n{}".format(output))
+        return False
     else:
         print("[*] Signed!")
+        return True
+
 
-def add_network_security_config(basedir):
+def add_network_security_config(basedir, name='network_security_config'):
     """Adds a network security config file that allows user 
     certificates.
     """
@@ -111,42 +144,129 @@ def add_network_security_config(basedir):
             <!-- Trust preinstalled CAs --> 
             <certificates src="system" /> 
             <!-- Trust user added CAs --> 
-            <certificates src="user" />
+            <certificates src="user" overridePins="true" />
             <!-- Trust any CA in this folder -->
-            <certificates src="@raw/cacert"/>
+            <certificates src="@raw/cacert" overridePins="true" />
         </trust-anchors> 
     </base-config> 
 </network-security-config>'''
-    with open(os.path.join(basedir, 'res', 'xml', 'network_security_config.xml'), 'w') as fh:
+    with open(os.path.join(basedir, 'res', 'xml', name + '.xml'), 'w') as fh:
         fh.write(data)
 
 
+def patch_network_security_config(filepath):
+    """Edits an existing network security config so the base-config, and
+    every domain-config with its own trust anchors or a pin-set, trusts
+    user certs and @raw/cacert with overridePins="true". Returns the
+    number of pin-sets that are now overridden.
+    """
+    import xml.etree.ElementTree as ET
+
+    # ElementTree renames prefixes it doesn't know (tools: becomes ns0:),
+    # so register the ones the file uses before writing it back.
+    for event, (prefix, uri) in ET.iterparse(filepath, events=('start-ns',)):
+        if prefix:
+            try:
+                ET.register_namespace(prefix, uri)
+            except ValueError:
+                pass
+
+    parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+    tree = ET.parse(filepath, parser)
+    root = tree.getroot()
+    parents = {child: parent for parent in root.iter() for child in parent}
+
+    # Indent new elements like the rest of the file (four spaces by default)
+    indent = '    '
+    if root.text and not root.text.strip() and '\n' in root.text:
+        indent = root.text.split('\n')[-1] or indent
+
+    def depth(element):
+        level = 0
+        while element in parents:
+            element = parents[element]
+            level += 1
+        return level
+
+    def add_element(parent, tag, first=False, **attrib):
+        """Adds an indented child element to the end of parent (or the
+        start, if first is True) and returns it.
+        """
+        level = depth(parent) + 1
+        child = ET.Element(tag, attrib)
+        parents[child] = parent
+        if first and len(parent):
+            child.tail = '\n' + indent * level
+            parent.text = '\n' + indent * level
+            parent.insert(0, child)
+        else:
+            if len(parent):
+                parent[-1].tail = '\n' + indent * level
+            else:
+                parent.text = '\n' + indent * level
+            child.tail = '\n' + indent * (level - 1)
+            parent.append(child)
+        return child
+
+    base_config = root.find('base-config')
+    if base_config is None:
+        base_config = add_element(root, 'base-config', first=True)
+    configs = [base_config] + [c for c in root.iter('domain-config')
+                               if c.find('trust-anchors') is not None or c.find('pin-set') is not None]
+
+    pin_sets = 0
+    for config in configs:
+        anchors = config.find('trust-anchors')
+        if anchors is None:
+            # Without its own anchors a config only trusts the system CAs
+            anchors = add_element(config, 'trust-anchors')
+            add_element(anchors, 'certificates', src='system')
+        for src in ('user', '@raw/cacert'):
+            cert = next((c for c in anchors.findall('certificates') if c.get('src') == src), None)
+            if cert is None:
+                cert = add_element(anchors, 'certificates', src=src)
+            cert.set('overridePins', 'true')
+        if config.find('pin-set') is not None:
+            pin_sets += 1
+    tree.write(filepath, encoding='utf-8', xml_declaration=True)
+    return pin_sets
+
+
 def do_network_security_config(directory):
-    """Checks for a network security config file in the project.
-    If present, reads the file and adds a line to allow user certs.
-    If not present, creates one to allow user certs.
+    """Checks the manifest for a network security config. If it has one,
+    patches every version of it (res/xml, res/xml-v24, etc.) to trust user
+    certs and override pin-sets. If not, creates one to allow user certs.
+    Returns True if the manifest already referenced a config.
     """
-    # Still need to add the line if the file already exists
-    if 'xml' in os.listdir(os.path.join(directory, 'res')):
-        if 'network_security_config.xml' in os.listdir(os.path.join(directory, 'res', 'xml')):
-            filepath = os.path.join(directory, 'res', 'xml', 'network_security_config.xml')
-            with open(filepath) as fh:
-                contents = fh.read()
-            new_contents = contents.replace('<trust-anchors>', '<trust-anchors>\n            <certificates src="user" />\n            <certificates src="@raw/cacert"/>')
-            with open(filepath, 'w') as fh:
-                fh.write(new_contents)
+    import check_for_cert_pinning as pinning
+    config_name = pinning.get_network_security_config_name(directory)
+    referenced = config_name is not None
+    if referenced:
+        config_paths = [path for path in pinning.find_network_security_configs(directory)
+                        if os.path.basename(path) == config_name + '.xml']
+        for filepath in config_paths:
+            pin_sets = patch_network_security_config(filepath)
+            print('[*] Patched {} ({} pin-set(s) overridden).'.format(filepath, pin_sets))
+        if config_paths:
             return True
-        else:
-            print('[*] Adding network_security_config.xml to {}.'.format(os.path.join(directory, 'res', 'xml')))
-            add_network_security_config(directory)
+        print('[*] The manifest references @xml/{}, but it was not found. Adding it.'.format(config_name))
     else:
-        print('[*] Creating {} and adding network_security_config.xml.'.format(os.path.join(directory, 'res', 'xml')))
-        os.mkdir(os.path.join(directory, 'res', 'xml'))
-        add_network_security_config(directory)
+        config_name = 'network_security_config'
+
+    xml_dir = os.path.join(directory, 'res', 'xml')
+    if os.path.isdir(xml_dir):
+        print('[*] Adding {}.xml to {}.'.format(config_name, xml_dir))
+    else:
+        print('[*] Creating {} and adding {}.xml.'.format(xml_dir, config_name))
+        os.makedirs(xml_dir)
+    add_network_security_config(directory, config_name)
+    return referenced
 
 
 def check_for_burp(host, port):
     """Checks to see if Burp is running."""
+    # urllib.request is slow to import, so only pay for it when Burp is needed.
+    import urllib.request
     url = ("http://{}:{}/".format(host, port))
     try:
         resp = urllib.request.urlopen(url)
@@ -160,6 +280,7 @@ def check_for_burp(host, port):
 
 def download_burp_cert(host, port):
     """Downloads the Burp Suite certificate."""
+    import urllib.request
     url = ("http://{}:{}/cert".format(host, port))
     file_name = 'cacert.der'
     # Download the file from url and save it locally under file_name:
@@ -184,6 +305,109 @@ def edit_manifest(filepath):
         fh.write(new_contents)
 
 
+@contextlib.contextmanager
+def timed_stage(stage, apk, timings=None):
+    """Records how long the body of the with block takes in timings
+    (stage_timings by default).
+    """
+    timings = stage_timings if timings is None else timings
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append({'apk': apk, 'stage': stage, 'seconds': time.perf_counter() - start})
+
+
+def write_stage_timings(path, timings=None):
+    """Writes stage timings as JSON to a file, or to stdout if path is '-'."""
+    import json
+    data = json.dumps(stage_timings if timings is None else timings, indent=2)
+    if path == '-':
+        print(data)
+    else:
+        with open(path, 'w') as fh:
+            fh.write(data)
+
+
+def report_code_pinning(findings):
+    """Prints a summary of pinning found in the smali code."""
+    if not findings:
+        return
+    files_by_description = {}
+    for filepath, method_name, description, line in findings:
+        files_by_description.setdefault(description, set()).add(filepath)
+    print('[!] Pinning in code was found. The network security config will not bypass it:')
+    for description, filepaths in sorted(files_by_description.items()):
+        filepaths = sorted(filepaths)
+        print('    {} in {}{}'.format(description, ', '.join(filepaths[:3]),
+                                      ' and {} other file(s)'.format(len(filepaths) - 3) if len(filepaths) > 3 else ''))
+
+
+def repackage_apk(filename, cert_path, keystore, timings=None, project_dir=None):
+    """Decompiles an APK, adds a network security config and the cert,
+    then rebuilds and signs it. Returns the path to the new APK, or None
+    if a step failed. Each stage's time is added to timings
+    (stage_timings by default). The APK is decoded into project_dir if
+    given, otherwise into <name>_out.
+    """
+    # Decompile the app with APKTool
+    print("[*] Decompiling {}...".format(filename))
+    with timed_stage('apktool_decompile', filename, timings):
+        decompiled = apktool_decompile(filename, project_dir)
+    if not decompiled:
+        return None
+    project_dir = project_dir or filename.replace('.apk', '_out')
+
+    # Look for pinning in the code while the project is patched and rebuilt.
+    # The network security config can't override it, so it's only reported.
+    import check_for_cert_pinning as pinning
+    code_pinning = []
+    def find_code_pinning():
+        with timed_stage('find_pinning_in_code', filename, timings):
+            code_pinning.extend(pinning.find_pinning_in_code(project_dir))
+    pinning_thread = threading.Thread(target=find_code_pinning)
+    pinning_thread.daemon = True
+    pinning_thread.start()
+
+    # Create or add to network_security_config.xml
+    with timed_stage('do_network_security_config', filename, timings):
+        config_exists = do_network_security_config(project_dir)
+
+    # Add the certificate to the project. The config refers to it
+    # as @raw/cacert, so keep that name regardless of the source name.
+    print("[*] Adding the cert to {}".format(project_dir))
+    cert_dest_path = os.path.join(project_dir, 'res', 'raw', 'cacert' + os.path.splitext(cert_path)[1])
+    with timed_stage('copy_cert', filename, timings):
+        os.makedirs(os.path.join(project_dir, 'res', 'raw'), exist_ok=True)
+        shutil.copy2(cert_path, cert_dest_path)
+    print("[*] {} copied to {}".format(cert_path, cert_dest_path))
+
+    # Edit the manifest if there wasn't already a config
+    if not config_exists:
+        print('[*] Changing the manifest...')
+        manifest_filepath = project_dir + os.sep + 'AndroidManifest.xml'
+        with timed_stage('edit_manifest', filename, timings):
+            edit_manifest(manifest_filepath)
+
+    # Repackage the APK
+    print('[*] Rebuilding the APK...')
+    with timed_stage('apktool_build', filename, timings):
+        built = apktool_build(project_dir)
+    pinning_thread.join()
+    report_code_pinning(code_pinning)
+    if not built:
+        return None
+    new_apk = os.path.join(project_dir, 'dist', os.listdir(project_dir + os.sep + 'dist')[0])
+
+    # Sign the APK
+    print("[*] Signing the APK...")
+    with timed_stage('do_jarsigner', filename, timings):
+        signed = do_jarsigner(new_apk, keystore)
+    if not signed:
+        return None
+    return new_apk
+
+
 def main():
     """Checks for tools, and repackages an APK to allow
     a user-installed SSL certificate.
@@ -218,47 +442,28 @@ def main():
         print("[*] Downloading Burp cert from http://{}:{}".format(burp_host, burp_port))
         certname = download_burp_cert(burp_host, burp_port)
 
+    # Generate a keystore once, rather than for every APK
+    global keystore_present
+    if not keystore_present:
+        print("[*] Generating keystore...")
+        with timed_stage('do_keytool', None):
+            do_keytool(keystore_filename)
+        keystore_present = True
+
     # Iterate through the APKs
     for file in args.apk_input_file:
+        new_apk = repackage_apk(file, certname, keystore_filename)
+        if new_apk:
+            print('[+] Repackaging complete. Install using "adb install {}"'.format(new_apk))
 
-        # Decompile the app with APKTool
-        print("[*] Decompiling {}...".format(file))
-        if not apktool_decompile(file):
-            continue
-        project_dir = file.replace('.apk', '_out') 
-
-        # Create or add to network_security_config.xml
-        config_exists = do_network_security_config(project_dir)
+    if args.timings:
+        write_stage_timings(args.timings)
 
-        # Add the certificate to the project
-        print("[*] Adding the cert to {}".format(project_dir))
-        cert_dest_path = os.path.join(project_dir, 'res', 'raw', certname)
-        os.makedirs(os.path.join(project_dir, 'res', 'raw'), exist_ok=True)
-        shutil.copy2(certname, cert_dest_path)
-        print("[*] {} copied to {}".format(certname, cert_dest_path))
 
-        # Edit the manifest if there wasn't already a config
-        if not config_exists:
-            print('[*] Changing the manifest...')
-            manifest_filepath = project_dir + os.sep + 'AndroidManifest.xml'
-            edit_manifest(manifest_filepath)
-
-        # Repackage the APK
-        print('[*] Rebuilding the APK...')
-        if not apktool_build(project_dir):
-            exit()
-        new_apk = os.path.join(project_dir, 'dist', os.listdir(project_dir + os.sep + 'dist')[0])
-
-        # Sign the APK
-        print("[*] Signing the APK...")
-        if not keystore_present:
-            print("[*] Generating keystore...")
-            do_keytool(keystore_filename)
-        do_jarsigner(new_apk, keystore_filename)
-        print('[+] Repackaging complete. Install using "adb install {}"'.format(new_apk))
-
-
-if __name__ == '__main__':
+def cli(argv=None):
+    """Parses and validates command line arguments and runs main()."""
+    global args, keystore_present, keystore_filename, cert_present, certname
+    global burp_host, burp_port
     parser = argparse.ArgumentParser()
     parser.add_argument('apk_input_file',
                         nargs='+',
@@ -272,12 +477,14 @@ if __name__ == '__main__':
                         const="127.0.0.1:8080",
                         default="127.0.0.1:8080",
                         help="Specify the host and port where burp is listening (default 127.0.0.1:8080)")
-    args = parser.parse_args()
+    parser.add_argument('-t', '--timings',
+                        help="Write the time taken by each stage as JSON to this file ('-' for stdout).")
+    args = parser.parse_args(argv)
 
     keystore_present = False
     if args.keystore_path:
         if not os.path.exists(args.keystore_path):
-            print("[-] The file, {}, cannot be found, or you do not have permission to open the file. Please check the file path and try again.".format(file))
+            print("[-] The file, {}, cannot be found, or you do not have permission to open the file. Please check the file path and try again.".format(args.keystore_path))
             exit()
         keystore_filename = args.keystore_path
         keystore_present = True
@@ -287,7 +494,7 @@ if __name__ == '__main__':
     cert_present = False
     if args.cert_path:
         if not os.path.exists(args.cert_path):
-            print("[-] The file, {}, cannot be found, or you do not have permission to open the file. Please check the file path and try again.".format(file))
+            print("[-] The file, {}, cannot be found, or you do not have permission to open the file. Please check the file path and try again.".format(args.cert_path))
             exit()
         certname = args.cert_path
         cert_present = True
@@ -310,4 +517,8 @@ if __name__ == '__main__':
 
     burp_host = args.proxy.split(":")[0] 
     burp_port = int(args.proxy.split(":")[1])
-    main()
\ No newline at end of file
+    main()
+
+
+if __name__ == '__main__':
+    cli()